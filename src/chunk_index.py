@@ -0,0 +1,167 @@
+from __future__ import print_function
+
+import fnmatch
+from struct import unpack
+
+import midi
+
+# this module indexes the MTrk chunks of a MIDI file from their length headers, so that
+# only selected tracks are decoded into midi events (see --tracks in midi_to_tidalcycles).
+# a light scan of the raw chunk bytes gives every track's name and note span without
+# building any event objects.
+
+
+class TrackSelectionError(ValueError):
+    """--tracks selectors that do not select any track with notes."""
+
+
+def read_varlen_at(data, pos):
+    """Read a MIDI variable length quantity starting at pos; return it and the next position."""
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def scan_track_chunk(data):
+    """
+    Walk the raw events of a track chunk without decoding them.
+    Returns the track name (as get_track_name would find it, or None), the absolute tick
+    of the last event that has a pitch (note on/off, aftertouch, pitch wheel) and the
+    polyphony of the track under the voice rule of note_table.assign_voices.
+    """
+    pos = 0
+    tick = 0
+    running_status = None
+    name = None
+    note_end_ticks = 0
+    voice = -1
+    polyphony = 0
+    while pos < len(data):
+        delta, pos = read_varlen_at(data, pos)
+        tick += delta
+        status = data[pos]
+        if status == 0xFF:
+            metacommand = data[pos + 1]
+            length, pos = read_varlen_at(data, pos + 2)
+            # TrackNameEvent or InstrumentNameEvent
+            if name is None and metacommand in (0x03, 0x04):
+                name = bytes(data[pos : pos + length]).decode("latin-1")
+            pos += length
+        elif status in (0xF0, 0xF7):
+            length, pos = read_varlen_at(data, pos + 1)
+            pos += length
+        else:
+            if status & 0x80:
+                running_status = status
+                pos += 1
+            kind = running_status & 0xF0
+            if kind == 0x90 and data[pos + 1] != 0:
+                voice += 1
+                polyphony = max(polyphony, voice + 1)
+            elif kind in (0x80, 0x90):
+                # note off, or note on with velocity 0
+                voice = -1
+            # program change and channel pressure carry a single data byte
+            pos += 1 if kind in (0xC0, 0xD0) else 2
+            if kind in (0x80, 0x90, 0xA0, 0xE0):
+                note_end_ticks = tick
+    return name, note_end_ticks, polyphony
+
+
+def read_chunk_index(filename):
+    """
+    Index the track chunks of a MIDI file: resolution, format and, for every track,
+    the byte offset of its MTrk header, its name, the tick of its last note event
+    and its polyphony.
+    """
+    with open(filename, "rb") as midifile:
+        magic = midifile.read(4)
+        if magic != b"MThd":
+            raise TypeError("Bad header in MIDI file.")
+        header_size, file_format, n_tracks, resolution = unpack(">LHHH", midifile.read(10))
+        midifile.seek(8 + header_size)
+        tracks = []
+        while len(tracks) < n_tracks:
+            offset = midifile.tell()
+            chunk_header = midifile.read(8)
+            if len(chunk_header) < 8:
+                break
+            magic, length = chunk_header[:4], unpack(">L", chunk_header[4:])[0]
+            if magic != b"MTrk":
+                # skip unknown chunk types
+                midifile.seek(length, 1)
+                continue
+            name, note_end_ticks, polyphony = scan_track_chunk(midifile.read(length))
+            tracks.append(
+                {
+                    "offset": offset,
+                    "name": name,
+                    "note_end_ticks": note_end_ticks,
+                    "polyphony": polyphony,
+                }
+            )
+    return {"resolution": resolution, "format": file_format, "tracks": tracks}
+
+
+def select_tracks(chunk_index, selectors):
+    """
+    Track indices matching a comma separated list of selectors: track indices
+    (negative counts from the end) or globs matched against the track names, ignoring case.
+    Raises TrackSelectionError for an index out of range or when no matching track has notes.
+    """
+    n_tracks = len(chunk_index["tracks"])
+    selected = set()
+    for selector in selectors.split(","):
+        selector = selector.strip()
+        if not selector:
+            continue
+        try:
+            index = int(selector)
+        except ValueError:
+            for track_idx, track in enumerate(chunk_index["tracks"]):
+                name = track["name"] or f"Track {track_idx}"
+                if fnmatch.fnmatchcase(name.lower(), selector.lower()):
+                    selected.add(track_idx)
+        else:
+            if not -n_tracks <= index < n_tracks:
+                raise TrackSelectionError(
+                    f"Track {index} is out of range, the file has {n_tracks} tracks."
+                )
+            selected.add(index % n_tracks)
+    if not selected:
+        raise TrackSelectionError(f"No track matches the selectors {selectors!r}.")
+    if not any(chunk_index["tracks"][track_idx]["polyphony"] for track_idx in selected):
+        raise TrackSelectionError(
+            f"The tracks matching the selectors {selectors!r} have no notes."
+        )
+    return sorted(selected)
+
+
+def read_midifile_tracks(filename, selectors=None):
+    """
+    Read a MIDI file, decoding only the tracks matching selectors (see select_tracks).
+    Unselected tracks stay empty so track indices are kept.
+    Returns the midi.Pattern and the tick of the last note event over all tracks,
+    or None for the note span when selectors is None and the whole file is read.
+    """
+    if selectors is None:
+        return midi.read_midifile(filename), None
+    chunk_index = read_chunk_index(filename)
+    pattern = midi.Pattern(
+        tracks=[midi.Track() for _ in chunk_index["tracks"]],
+        resolution=chunk_index["resolution"],
+        format=chunk_index["format"],
+    )
+    reader = midi.FileReader()
+    with open(filename, "rb") as midifile:
+        for track_idx in select_tracks(chunk_index, selectors):
+            midifile.seek(chunk_index["tracks"][track_idx]["offset"])
+            reader.parse_track(midifile, pattern[track_idx])
+    max_note_end_ticks = max(
+        [track["note_end_ticks"] for track in chunk_index["tracks"]] + [0]
+    )
+    return pattern, max_note_end_ticks
@@ -2,20 +2,31 @@ from __future__ import print_function
 import midi
 import numpy as np
 
+from note_table import note_table_from_pattern
+
 # this function extracts chords from MIDI files by looking for local maxima in polyphony.
 
 def get_chords(filename):
     midi_obj = midi.read_midifile(filename)
+    note_table = note_table_from_pattern(midi_obj, [len(midi_obj) - 1])
+    n_notes = len(note_table["pitch"])
+    # interleave note ons and note offs in time: at the same tick, release the notes that
+    # were already held, then press, then release the zero length notes just pressed
+    ticks = np.concatenate([note_table["onset"], note_table["offset"]])
+    is_on = np.concatenate([np.ones(n_notes, dtype=bool), np.zeros(n_notes, dtype=bool)])
+    zero_length = note_table["offset"] == note_table["onset"]
+    rank = np.concatenate([np.ones(n_notes, dtype=int), np.where(zero_length, 2, 0)])
+    order = np.lexsort((rank, ticks))
+    # convert from midinote numbers to tidalcycles n; subtract 60
+    notes = np.concatenate([note_table["pitch"], note_table["pitch"]]) - 60
     note_history = [] # list of note stacks
     note_stack = []
-    for index, event in enumerate(midi_obj[-1]):
-        if type(event) == midi.events.NoteOnEvent:
-            # convert from midinote numbers to tidalcycles n; subtract 60
-            note_stack.append(event.pitch - 60)
-            note_history.append(tuple(note_stack))
-        elif type(event) == midi.events.NoteOffEvent:
-            note_stack.remove(event.pitch - 60)
-            note_history.append(tuple(note_stack))
+    for index in order:
+        if is_on[index]:
+            note_stack.append(int(notes[index]))
+        else:
+            note_stack.remove(int(notes[index]))
+        note_history.append(tuple(note_stack))
 
     return note_history
 
@@ -1,14 +1,7 @@
 import midi
 
 from midi_to_tidalcycles import vel_to_amp
-
-def midinote_to_scale_degree(midi_note, scale_list, z = 12):
-    #midi_note = int(midi_note) - 60
-    # for non-12-TET scales, z may not be 12.
-    q, r = divmod(midi_note, int(z)) 
-    print(q,r)
-    scale_degree = q*len(scale_list) + scale_list.index(r)
-    return scale_degree
+from scales import build_scale, notes_to_scale_degrees
 
 
 def get_melody(filename):
@@ -40,11 +33,13 @@ def tc_take_notation(pitches, amps, pname = 'notez', aname = 'ampz', scale = Fal
         pitch_string = "\"" + " ".join([str(p) for p in pitches]) + "\""
         out += " ".join(["nT",pname, str(len(pitches)), pitch_string])   
     else:
-        scale_list = sorted(list(set([x % int(z) for x in pitches]))) 
+        # pitches are already relative to middle c, so no offset
+        scale = build_scale(pitches, z = int(z), offset = 0)
+        scale_list = scale["scale_list"]
         print(scale_list)
         print(pitches)
         scale_pat = " ".join([str(int(x)) for x in scale_list])
-        notes_degrees = " ".join([str(midinote_to_scale_degree(x, scale_list, z)) for x in pitches])
+        notes_degrees = " ".join([str(d) for d in notes_to_scale_degrees(pitches, scale)])
         out += "nT " + pname + " " + str(len(pitches)) 
         out +=  " (tScale\' " + str(z) +  " \"" + scale_pat + "\" (\""  + notes_degrees + "\")) "
 
@@ -0,0 +1,334 @@
+from __future__ import print_function
+
+import argparse
+import socket
+from collections import deque
+
+import midi
+import numpy as np
+
+from midi_to_tidalcycles import (
+    get_event_type,
+    midinote_to_note_name,
+    simplify_repeats,
+    vel_to_amp,
+)
+
+# this module quantizes MIDI note events as they arrive (e.g. from a live performer)
+# instead of from a finished file, and re-renders the latest cycles as a TidalCycles pattern.
+# one tidal cycle is 4 quarter notes, matching the slow (n_quanta / resolution / 4) of the file converters.
+
+
+class LiveQuantizer(object):
+    """
+    Incrementally quantizes note on/off events into per-cycle grids.
+
+    Uses the same voice and legato logic as midi_to_multitrack_arrays: every note on
+    takes the next voice, every note off resets the voice counter, and legato is the
+    number of quanta between a note on and the note off that pairs with it (first in
+    first out per channel and pitch, as in note_table.pair_note_events).
+    Polyphony grows as needed instead of being inferred up front.
+
+    Each event only touches the cycle its note on landed in, so adding an event is O(1)
+    amortized. Rendered cycles are cached and only the cycles marked dirty are re-rendered
+    by to_tidal.
+    """
+
+    def __init__(
+        self,
+        ticks_per_qn=96,
+        quanta_per_qn=8,
+        velocity_on=False,
+        legato_on=False,
+        max_cycles=64,
+    ):
+        self.ticks_per_quanta = ticks_per_qn / float(quanta_per_qn)
+        self.quanta_per_qn = quanta_per_qn
+        self.quanta_per_cycle = quanta_per_qn * 4
+        self.velocity_on = velocity_on
+        self.legato_on = legato_on
+        # cycles older than this are dropped to keep memory bounded during long sessions
+        self.max_cycles = max_cycles
+
+        self.polyphony = 0
+        self.cum_ticks = 0
+        self.voice = -1
+        # cycle index -> {"notes", "velocities", "legatos"} arrays of shape (quanta_per_cycle, polyphony)
+        self.cycles = {}
+        # cycle index -> list of per-voice (note tokens, amp tokens, legato tokens)
+        self.rendered = {}
+        self.dirty = set()
+        # (channel, pitch) -> deque of [absolute quanta index, voice], oldest note on first
+        self.currently_active_notes = {}
+
+    def current_quanta(self):
+        return int(self.cum_ticks / self.ticks_per_quanta)
+
+    def current_cycle(self):
+        return self.current_quanta() // self.quanta_per_cycle
+
+    def _get_cycle(self, cycle):
+        if cycle not in self.cycles:
+            shape = (self.quanta_per_cycle, self.polyphony)
+            self.cycles[cycle] = {
+                "notes": np.zeros(shape),
+                "velocities": np.zeros(shape) if self.velocity_on else None,
+                "legatos": np.zeros(shape) if self.legato_on else None,
+            }
+            # drop the oldest cycle once the history is full
+            if len(self.cycles) > self.max_cycles:
+                oldest = min(self.cycles)
+                del self.cycles[oldest]
+                self.rendered.pop(oldest, None)
+                self.dirty.discard(oldest)
+        return self.cycles[cycle]
+
+    def _widen(self, cycle_data):
+        # a cycle allocated before a new voice appeared gets one more column
+        for key in ("notes", "velocities", "legatos"):
+            if cycle_data[key] is not None:
+                pad = self.polyphony - cycle_data[key].shape[1]
+                cycle_data[key] = np.pad(cycle_data[key], ((0, 0), (0, pad)))
+
+    def _set_legato(self, quanta_index, voice, note_length):
+        cycle = quanta_index // self.quanta_per_cycle
+        if cycle in self.cycles:
+            self.cycles[cycle]["legatos"][quanta_index % self.quanta_per_cycle, voice] = (
+                note_length
+            )
+            self.dirty.add(cycle)
+
+    def add_event(self, event):
+        """Add a single MIDI event (tick is relative to the previous event, as in a track)."""
+        self.cum_ticks += event.tick
+        event_type = get_event_type(event)
+
+        if event_type == "note_on_event":
+            self.voice += 1
+            if self.voice >= self.polyphony:
+                self.polyphony = self.voice + 1
+            quanta_index = self.current_quanta()
+            cycle = quanta_index // self.quanta_per_cycle
+            cycle_data = self._get_cycle(cycle)
+            if cycle_data["notes"].shape[1] < self.polyphony:
+                self._widen(cycle_data)
+            row = quanta_index % self.quanta_per_cycle
+            cycle_data["notes"][row, self.voice] = event.pitch
+            if self.velocity_on:
+                cycle_data["velocities"][row, self.voice] = event.velocity
+            if self.legato_on:
+                key = (event.channel, event.pitch)
+                self.currently_active_notes.setdefault(key, deque()).append(
+                    [quanta_index, self.voice]
+                )
+            self.dirty.add(cycle)
+
+        elif event_type == "note_off_event":
+            key = (event.channel, event.pitch)
+            if self.legato_on and key in self.currently_active_notes:
+                held = self.currently_active_notes[key]
+                quanta_index, voice = held.popleft()
+                if not held:
+                    del self.currently_active_notes[key]
+                self._set_legato(quanta_index, voice, self.current_quanta() - quanta_index)
+            self.voice = -1
+
+    def _render_cycle(self, cycle):
+        cycle_data = self.cycles[cycle]
+        voices = []
+        for j in range(cycle_data["notes"].shape[1]):
+            note_tokens = [midinote_to_note_name(x) for x in cycle_data["notes"][:, j]]
+            amp_tokens = None
+            legato_tokens = None
+            if self.velocity_on:
+                amp_tokens = [vel_to_amp(x) for x in cycle_data["velocities"][:, j]]
+            if self.legato_on:
+                # Convert to int if whole number (0.0 -> 0, 8.0 -> 8)
+                legato_tokens = [
+                    int(x) if x == int(x) else x for x in cycle_data["legatos"][:, j]
+                ]
+            voices.append((note_tokens, amp_tokens, legato_tokens))
+        self.rendered[cycle] = voices
+
+    def _rest_tokens(self):
+        note_tokens = ["~"] * self.quanta_per_cycle
+        amp_tokens = [0.0] * self.quanta_per_cycle if self.velocity_on else None
+        legato_tokens = [0] * self.quanta_per_cycle if self.legato_on else None
+        return note_tokens, amp_tokens, legato_tokens
+
+    def to_tidal(self, n_cycles=4, consolidate=False):
+        """
+        Render the latest n_cycles (ending with the current one) as a tidal expression.
+        Fewer cycles are rendered until n_cycles have been played.
+        Notes that are still held get a provisional legato up to the current quanta.
+        """
+        last_cycle = self.current_cycle()
+        first_cycle = max(last_cycle - n_cycles + 1, 0)
+        n_rendered = last_cycle - first_cycle + 1
+
+        if self.legato_on:
+            now = self.current_quanta()
+            held = [note for notes in self.currently_active_notes.values() for note in notes]
+            for quanta_index, voice in held:
+                if quanta_index // self.quanta_per_cycle >= first_cycle:
+                    self._set_legato(quanta_index, voice, max(now - quanta_index, 1))
+
+        for cycle in self.dirty:
+            self._render_cycle(cycle)
+        self.dirty = set()
+
+        rests = self._rest_tokens()
+        n_voices = max(self.polyphony, 1)
+        voice_lines = []
+        for j in range(n_voices):
+            columns = ([], [], [])
+            for cycle in range(first_cycle, last_cycle + 1):
+                voices = self.rendered.get(cycle, [])
+                tokens = voices[j] if j < len(voices) else rests
+                for column, cycle_tokens in zip(columns, tokens):
+                    if cycle_tokens is not None:
+                        column.extend(cycle_tokens)
+            if consolidate:
+                columns = [simplify_repeats(c) if c else c for c in columns]
+            notes_str = " ".join(str(x) for x in columns[0])
+            lines = [f'n "{notes_str}"']
+            if self.velocity_on:
+                vels_str = " ".join(str(x) for x in columns[1])
+                lines.append(f'# amp "{vels_str}"')
+            if self.legato_on:
+                legatos_str = " ".join(str(x) for x in columns[2])
+                lines.append(f'# legato "{legatos_str}"')
+            voice_lines.append(lines)
+
+        slow_cmd = f"slow ({n_rendered * self.quanta_per_cycle / self.quanta_per_qn}/4) $ "
+        if n_voices == 1 and not (self.velocity_on or self.legato_on):
+            return slow_cmd + voice_lines[0][0]
+        out = slow_cmd + "stack [\n"
+        out += ",\n".join("\n".join("     " + l for l in lines) for lines in voice_lines)
+        out += "\n     ]"
+        return out
+
+
+def quantize_stream(events, quantizer, n_cycles=4, consolidate=False):
+    """
+    Feed events into the quantizer and yield refreshed tidal code every time a new cycle starts,
+    and once more at the end of the stream if events arrived since the last refresh.
+    events can be any iterable of MIDI events, e.g. a track, a simulated feed or socket_events().
+    """
+    last_cycle = quantizer.current_cycle()
+    changed = False
+    for event in events:
+        quantizer.add_event(event)
+        changed = True
+        cycle = quantizer.current_cycle()
+        if cycle != last_cycle:
+            last_cycle = cycle
+            changed = False
+            yield quantizer.to_tidal(n_cycles=n_cycles, consolidate=consolidate)
+    if changed:
+        yield quantizer.to_tidal(n_cycles=n_cycles, consolidate=consolidate)
+
+
+def socket_events(port, host="localhost"):
+    """
+    Yield MIDI events from the first client connecting to a local TCP socket.
+    Each line is "on PITCH VELOCITY TICK" or "off PITCH TICK", with TICK relative to the previous event.
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, port))
+    server.listen(1)
+    connection, _ = server.accept()
+    try:
+        for line in connection.makefile("r"):
+            fields = line.split()
+            if len(fields) == 4 and fields[0] == "on":
+                yield midi.NoteOnEvent(
+                    tick=int(fields[3]), pitch=int(fields[1]), velocity=int(fields[2])
+                )
+            elif len(fields) == 3 and fields[0] == "off":
+                yield midi.NoteOffEvent(tick=int(fields[2]), pitch=int(fields[1]))
+    finally:
+        connection.close()
+        server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "midi_file",
+        nargs="?",
+        help="replay the last track of this file as a simulated live feed",
+    )
+    parser.add_argument(
+        "--port", "-P", type=int, help="read events from a local socket on this port"
+    )
+    parser.add_argument(
+        "--ticks",
+        "-t",
+        default=96,
+        type=int,
+        help="ticks per quarter note of the socket feed (default 96)",
+    )
+    parser.add_argument(
+        "--resolution",
+        "-q",
+        default=8,
+        type=int,
+        help="specify number of quanta per quarter note (default 8 for 32nd note resolution)",
+    )
+    parser.add_argument(
+        "--cycles",
+        "-N",
+        default=4,
+        type=int,
+        help="number of latest cycles to print on every refresh (default 4)",
+    )
+    parser.add_argument(
+        "--legato",
+        "-l",
+        const=True,
+        default=False,
+        help="print legato pattern",
+        action="store_const",
+    )
+    parser.add_argument(
+        "--amp",
+        "-a",
+        const=True,
+        default=False,
+        help="print amplitude pattern",
+        action="store_const",
+    )
+    parser.add_argument(
+        "--consolidate",
+        "-c",
+        const=True,
+        default=False,
+        help="consolidate repeated notes and values with '!' notation",
+        action="store_const",
+    )
+    args = parser.parse_args()
+
+    if args.port is not None:
+        ticks_per_qn = args.ticks
+        events = socket_events(args.port)
+    elif args.midi_file:
+        pattern = midi.read_midifile(args.midi_file)
+        ticks_per_qn = pattern.resolution
+        events = pattern[-1]
+    else:
+        parser.error("give a MIDI file to replay or a --port to listen on")
+
+    quantizer = LiveQuantizer(
+        ticks_per_qn=ticks_per_qn,
+        quanta_per_qn=args.resolution,
+        velocity_on=args.amp,
+        legato_on=args.legato,
+        max_cycles=max(64, args.cycles),
+    )
+    for code in quantize_stream(
+        events, quantizer, n_cycles=args.cycles, consolidate=args.consolidate
+    ):
+        print(code)
+        print("")
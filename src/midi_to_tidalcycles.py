@@ -1,10 +1,18 @@
 from __future__ import print_function
 
 import argparse
+import contextlib
+import io
+import sys
 
 import midi
 import numpy as np
 
+from chunk_index import TrackSelectionError, read_midifile_tracks
+from note_table import note_table_from_pattern, select_track
+from scales import build_scale, estimate_key, scale_degree_tokens, scale_function
+from shared_patterns import print_shared_patterns, share_patterns, shared_patterns_block
+
 
 def midinote_to_note_name(midi_note, strudel_mode=False):
     if midi_note == 0.0:
@@ -34,14 +42,44 @@ def midinote_to_note_name(midi_note, strudel_mode=False):
     return full_note_name
 
 
-def midinote_to_scale_degree(midi_note, scale_list, z=12):
-    if midi_note == 0.0:
-        return "~"
-    midi_note = int(midi_note) - 60
-    # for non-12-TET scales, z may not be 12.
-    q, r = divmod(midi_note, z)
-    scale_degree = q * len(scale_list) + scale_list.index(r)
-    return scale_degree
+def scale_for_notes(_args, notes):
+    """Scale for --scale built from the notes of a track, rooted on the estimated key with --key."""
+    if not _args.scale:
+        return None
+    played = notes[notes != 0.0]
+    root, mode = 0, None
+    if _args.key:
+        root, mode = estimate_key(played, z=_args.edo)
+    scale = build_scale(played, z=_args.edo, root=root)
+    scale["mode"] = mode
+    return scale
+
+
+def key_name(scale):
+    if scale["z"] == 12:
+        name = midinote_to_note_name(60 + scale["root"]).rstrip("0123456789")
+    else:
+        name = str(scale["root"])
+    if scale["mode"] is not None:
+        name += " " + scale["mode"]
+    return name
+
+
+def note_pattern(notes, consolidate=False, scale=None):
+    """n pattern for one voice, as note names or as degrees of scale."""
+    if scale is None:
+        notes_names = [midinote_to_note_name(x) for x in notes]
+    else:
+        notes_names = scale_degree_tokens(notes, scale)
+    if consolidate:
+        notes_names = simplify_repeats(notes_names)
+    notes_str = " ".join(str(x) for x in notes_names)
+    if scale is None:
+        return f'n "{notes_str}"'
+    pattern = f'n ({scale_function(scale)} $ "{notes_str}")'
+    if scale["root"] != 0:
+        pattern += f" |+ n {scale['root']}"
+    return pattern
 
 
 def assert_end_of_track(midi_pattern):
@@ -64,34 +102,6 @@ def get_event_type(event):
     return event_type
 
 
-def infer_polyphony(midi_pattern):
-    assert_end_of_track(midi_pattern)
-    n_adjacent_on_events = 0
-    inferred_polyphony = 0
-    for index, event in enumerate(midi_pattern[-1]):
-        event_type = get_event_type(event)
-        if event_type == "note_on_event":  # starting note on
-            n_adjacent_on_events += 1
-            inferred_polyphony = max(inferred_polyphony, n_adjacent_on_events)
-        elif event_type == "note_off_event":
-            n_adjacent_on_events = 0
-    return inferred_polyphony
-
-
-def infer_polyphony_for_track(track):
-    """Infer polyphony for a single track."""
-    n_adjacent_on_events = 0
-    inferred_polyphony = 0
-    for event in track:
-        event_type = get_event_type(event)
-        if event_type == "note_on_event":
-            n_adjacent_on_events += 1
-            inferred_polyphony = max(inferred_polyphony, n_adjacent_on_events)
-        elif event_type == "note_off_event":
-            n_adjacent_on_events = 0
-    return inferred_polyphony
-
-
 def get_track_name(track):
     """Extract track name from track events."""
     for event in track:
@@ -102,33 +112,53 @@ def get_track_name(track):
     return None
 
 
-def track_has_notes(track):
-    """Check if a track contains any note events."""
-    for event in track:
-        if get_event_type(event) == "note_on_event":
-            return True
-    return False
+def fill_arrays(
+    note_table, n_quanta, polyphony, ticks_per_quanta, velocity_on, legato_on, clamp=False
+):
+    """
+    Fill the (n_quanta, polyphony) note/velocity/legato arrays from a note table.
+    clamp keeps notes that start or end past n_quanta inside the last quanta.
+    """
+    quanta_index = (note_table["onset"] / ticks_per_quanta).astype(int)
+    quanta_note_off_index = (note_table["offset"] / ticks_per_quanta).astype(int)
+    if clamp:
+        quanta_index = np.minimum(quanta_index, n_quanta - 1)
+        quanta_note_off_index = np.minimum(quanta_note_off_index, n_quanta - 1)
+    voice = note_table["voice"]
 
+    note_vector = np.zeros((n_quanta, polyphony))
+    note_vector[quanta_index, voice] = note_table["pitch"]
+    velocity_vector = None
+    legato_vector = None
+    if velocity_on:
+        velocity_vector = np.zeros((n_quanta, polyphony))
+        velocity_vector[quanta_index, voice] = note_table["velocity"]
+    if legato_on:
+        legato_vector = np.zeros((n_quanta, polyphony))
+        legato_vector[quanta_index, voice] = quanta_note_off_index - quanta_index
+    return note_vector, velocity_vector, legato_vector
 
-def midi_to_array(
-    filename,
-    quanta_per_qn=4,
-    velocity_on=False,
-    legato_on=False,
-    print_events=False,
-    debug=False,
-    hide=False,
-):
-    pattern = midi.read_midifile(filename)
 
+def print_note_table(note_table, ticks_per_quanta):
+    for voice, onset in zip(note_table["voice"], note_table["onset"]):
+        print(f"voice {voice}, quanta {int(onset / ticks_per_quanta)}")
+
+
+def single_track_layout(pattern, quanta_per_qn=4, print_events=False, debug=False, hide=False):
+    """
+    Shared setup for the single-track converters: the note table of the last track,
+    its number of quanta (padded to whole bars) and its polyphony.
+    """
     ticks_per_quanta = (
         pattern.resolution / quanta_per_qn
     )  # = ticks per quarter note * quarter note per quanta
-    last_event = pattern[-1][-1]
-    assert type(last_event) == midi.events.EndOfTrackEvent
-    cum_ticks = 0
-    for index, event in enumerate(pattern[-1]):
-        cum_ticks += event.tick
+    assert_end_of_track(pattern)
+    if print_events or debug:
+        for event in pattern[-1]:
+            print(event)
+    last_track = len(pattern) - 1
+    note_table = note_table_from_pattern(pattern, [last_track])
+    cum_ticks = note_table["end_ticks"][last_track]
     ticks_per_beat = pattern.resolution * 4
     pretail_total_beats = cum_ticks / float(ticks_per_beat)
     total_beats = int(np.ceil(pretail_total_beats))
@@ -136,53 +166,33 @@ def midi_to_array(
     # this int() is just for type matching in python 3 and shouldn't be rounding anything--
     # n_quanta should already be an int.
     n_quanta = int(real_total_ticks / ticks_per_quanta)
-    polyphony = infer_polyphony(pattern)
+    polyphony = int(note_table["voice"].max()) + 1 if len(note_table["voice"]) else 0
     if not hide:
         print("inferred polyphony is ", end="")
         print(polyphony)
-    note_vector = np.zeros((n_quanta, polyphony))
-    if velocity_on:
-        velocity_vector = np.zeros((n_quanta, polyphony))
-    if legato_on:
-        legato_vector = np.zeros((n_quanta, polyphony))
-        currently_active_notes = {}
-    cum_ticks = 0
-    voice = -1
-    for event in pattern[-1]:
-        event_type = get_event_type(event)
-        if print_events or debug:
-            print(event)
-        cum_ticks += event.tick
-        if event_type == "note_on_event":
-            voice += 1
-            quanta_index = int(cum_ticks / ticks_per_quanta)
-            if debug:
-                print("voice number ", end="")
-                print(voice)
-                print("quanta number ", end="")
-                print(quanta_index)
-            note_vector[quanta_index, voice] = event.pitch
-            if legato_on:
-                currently_active_notes[event.pitch] = [quanta_index, voice]
-            if velocity_on:
-                velocity_vector[quanta_index, voice] = event.velocity
-        elif (event_type == "note_off_event") & (legato_on):
-            quanta_note_off_index = int(cum_ticks / ticks_per_quanta)
-            note_length = quanta_note_off_index - currently_active_notes[event.pitch][0]
-            legato_vector[
-                currently_active_notes[event.pitch][0],
-                currently_active_notes[event.pitch][1],
-            ] = note_length
-            del currently_active_notes[event.pitch]
-            voice = -1  # -= 1
-        else:  # end of track
-            # turn all notes off
-            quanta_note_off_index = int(cum_ticks / ticks_per_quanta)
-            if legato_on:
-                for key in currently_active_notes.keys():
-                    note_length = quanta_note_off_index - currently_active_notes[key][0]
-                    legato_vector[currently_active_notes[key], voice] = note_length
-            voice = -1
+    if debug:
+        print_note_table(note_table, ticks_per_quanta)
+    return note_table, n_quanta, polyphony
+
+
+def midi_to_array(
+    filename,
+    quanta_per_qn=4,
+    velocity_on=False,
+    legato_on=False,
+    print_events=False,
+    debug=False,
+    hide=False,
+):
+    pattern = midi.read_midifile(filename)
+    ticks_per_quanta = pattern.resolution / quanta_per_qn
+    note_table, n_quanta, polyphony = single_track_layout(
+        pattern, quanta_per_qn, print_events, debug, hide
+    )
+    # notes still held at the end of the track are turned off there
+    note_vector, velocity_vector, legato_vector = fill_arrays(
+        note_table, n_quanta, polyphony, ticks_per_quanta, velocity_on, legato_on
+    )
     if not legato_on and velocity_on:
         return note_vector, velocity_vector
 
@@ -196,96 +206,113 @@ def midi_to_array(
         return note_vector
 
 
-def midi_to_multitrack_arrays(
-    filename,
-    quanta_per_qn=4,
-    velocity_on=False,
-    legato_on=False,
-    print_events=False,
-    debug=False,
-    hide=False,
-):
+def multitrack_layout(pattern, quanta_per_qn=4, hide=False, max_note_end_ticks=None):
     """
-    Process all tracks in a MIDI file, returning a list of track data.
-    Each track becomes a separate entry with its own note/velocity/legato arrays.
+    Shared setup for the multitrack converters: the note table of the whole pattern,
+    the number of quanta shared by all tracks, and name/polyphony of every track with notes.
+    max_note_end_ticks can be given when only some tracks of the pattern were read.
     """
-    pattern = midi.read_midifile(filename)
     ticks_per_quanta = pattern.resolution / quanta_per_qn
-    ticks_per_beat = pattern.resolution * 4
 
-    # Find total length across all tracks (based on last note, not track end)
-    max_note_end_ticks = 0
-    for track in pattern:
-        cum_ticks = 0
-        for event in track:
-            cum_ticks += event.tick
-            # Track the last note-off as the true end
-            if hasattr(event, "pitch"):
-                max_note_end_ticks = max(max_note_end_ticks, cum_ticks)
+    if max_note_end_ticks is None:
+        # Find total length across all tracks (based on last note, not track end)
+        max_note_end_ticks = 0
+        for track in pattern:
+            cum_ticks = 0
+            for event in track:
+                cum_ticks += event.tick
+                # Track the last note-off as the true end
+                if hasattr(event, "pitch"):
+                    max_note_end_ticks = max(max_note_end_ticks, cum_ticks)
 
     # Use actual note end, not padded to full beats (avoids trailing silence)
     n_quanta = int(np.ceil(max_note_end_ticks / ticks_per_quanta))
 
-    tracks_data = []
-
+    note_table = note_table_from_pattern(pattern)
+    track_infos = []
     for track_idx, track in enumerate(pattern):
-        if not track_has_notes(track):
+        # the note table lists the tracks one after another
+        start, stop = np.searchsorted(note_table["track"], [track_idx, track_idx + 1])
+        if start == stop:
             continue
 
         track_name = get_track_name(track) or f"Track {track_idx}"
-        polyphony = infer_polyphony_for_track(track)
-
-        if polyphony == 0:
-            continue
+        polyphony = int(note_table["voice"][start:stop].max()) + 1
 
         if not hide:
             print(f"Track {track_idx}: {track_name}, polyphony: {polyphony}")
 
-        note_vector = np.zeros((n_quanta, polyphony))
-        velocity_vector = np.zeros((n_quanta, polyphony)) if velocity_on else None
-        legato_vector = np.zeros((n_quanta, polyphony)) if legato_on else None
-        currently_active_notes = {} if legato_on else None
+        track_infos.append(
+            {
+                "name": track_name,
+                "track_idx": track_idx,
+                "polyphony": polyphony,
+                "rows": (int(start), int(stop)),
+            }
+        )
+    return note_table, n_quanta, track_infos
 
-        cum_ticks = 0
-        voice = -1
 
-        for event in track:
-            event_type = get_event_type(event)
-            if print_events or debug:
+def midi_to_multitrack_arrays(
+    filename,
+    quanta_per_qn=4,
+    velocity_on=False,
+    legato_on=False,
+    print_events=False,
+    debug=False,
+    hide=False,
+    tracks=None,
+    weighted=False,
+):
+    """
+    Process all tracks in a MIDI file, returning a list of track data.
+    Each track becomes a separate entry with its own note/velocity/legato arrays.
+    tracks is an optional --tracks selector; only the matching tracks are decoded.
+    weighted skips the arrays and keeps each track's note table for the @ weighted output.
+    """
+    pattern, max_note_end_ticks = read_midifile_tracks(filename, tracks)
+    ticks_per_quanta = pattern.resolution / quanta_per_qn
+    note_table, n_quanta, track_infos = multitrack_layout(
+        pattern, quanta_per_qn, hide, max_note_end_ticks
+    )
+    tracks_data = []
+
+    for track_info in track_infos:
+        track_idx = track_info["track_idx"]
+        track = pattern[track_idx]
+        track_table = select_track(note_table, track_idx)
+        track_name = track_info["name"]
+        polyphony = track_info["polyphony"]
+
+        if print_events or debug:
+            for event in track:
                 print(event)
-            cum_ticks += event.tick
-
-            if event_type == "note_on_event":
-                voice += 1
-                if voice >= polyphony:
-                    voice = polyphony - 1  # clamp to avoid index errors
-                quanta_index = int(cum_ticks / ticks_per_quanta)
-                if quanta_index >= n_quanta:
-                    quanta_index = n_quanta - 1
-
-                if debug:
-                    print(f"voice {voice}, quanta {quanta_index}")
-
-                note_vector[quanta_index, voice] = event.pitch
-                if legato_on:
-                    currently_active_notes[event.pitch] = [quanta_index, voice]
-                if velocity_on:
-                    velocity_vector[quanta_index, voice] = event.velocity
-
-            elif event_type == "note_off_event":
-                if legato_on and event.pitch in currently_active_notes:
-                    quanta_note_off_index = int(cum_ticks / ticks_per_quanta)
-                    if quanta_note_off_index >= n_quanta:
-                        quanta_note_off_index = n_quanta - 1
-                    note_length = (
-                        quanta_note_off_index - currently_active_notes[event.pitch][0]
-                    )
-                    legato_vector[
-                        currently_active_notes[event.pitch][0],
-                        currently_active_notes[event.pitch][1],
-                    ] = note_length
-                    del currently_active_notes[event.pitch]
-                voice = -1
+        if debug:
+            print_note_table(track_table, ticks_per_quanta)
+
+        if weighted:
+            track_data = {
+                "name": track_name,
+                "track_idx": track_idx,
+                "notes": None,
+                "velocities": None,
+                "legatos": None,
+                "polyphony": polyphony,
+                "table": track_table,
+                "ticks_per_quanta": ticks_per_quanta,
+            }
+            tracks_data.append(track_data)
+            continue
+
+        note_vector, velocity_vector, legato_vector = fill_arrays(
+            track_table,
+            n_quanta,
+            polyphony,
+            ticks_per_quanta,
+            velocity_on,
+            legato_on,
+            clamp=True,
+        )
 
         track_data = {
             "name": track_name,
@@ -348,14 +375,297 @@ def simplify_repeats(list_pattern, simplify_zeros=True):
     return output_list
 
 
+def constant_value(values, notes):
+    """Return the value shared by every note cell of a voice, or None if it varies."""
+    note_values = values[notes != 0.0]
+    if len(note_values) == 0 or not (note_values == note_values[0]).all():
+        return None
+    return note_values[0]
+
+
+def amp_pattern(notes, vels, consolidate=False, optimize=False):
+    """
+    Quoted amp pattern for one voice.
+    With optimize, a voice whose notes all share one amp becomes a scalar (0.79).
+    """
+    if optimize:
+        vel = constant_value(vels, notes)
+        if vel is not None:
+            return str(vel_to_amp(vel))
+    note_vels = [vel_to_amp(x) for x in vels]
+    if consolidate:
+        note_vels = simplify_repeats(note_vels)
+    return '"' + " ".join(str(x) for x in note_vels) + '"'
+
+
+def legato_pattern(notes, legatos, consolidate=False, optimize=False, whole_numbers=True):
+    """
+    Quoted legato pattern for one voice, see amp_pattern.
+    whole_numbers prints whole legatos as ints (0.0 -> 0, 8.0 -> 8).
+    """
+    if whole_numbers:
+        legatos = [int(x) if x == int(x) else x for x in legatos]
+    if optimize:
+        legato = constant_value(np.array(legatos), notes)
+        if legato is not None:
+            return str(legato)
+    note_legatos = list(legatos)
+    if consolidate:
+        note_legatos = simplify_repeats(note_legatos)
+    return '"' + " ".join(str(x) for x in note_legatos) + '"'
+
+
+def control_pattern_bytes(notes, vels, legatos, consolidate=False, optimize=False):
+    """Number of characters taken by the amp and legato patterns of all voices."""
+    n_bytes = 0
+    for j in range(notes.shape[1]):
+        if vels is not None:
+            n_bytes += len(amp_pattern(notes[:, j], vels[:, j], consolidate, optimize))
+        if legatos is not None:
+            n_bytes += len(
+                legato_pattern(notes[:, j], legatos[:, j], consolidate, optimize)
+            )
+    return n_bytes
+
+
+def snap_amps(amps, n_levels):
+    """Bucket amps into n_levels evenly spaced levels between their min and max."""
+    lo = amps.min()
+    hi = amps.max()
+    if n_levels == 1 or hi == lo:
+        return np.full(amps.shape, round((lo + hi) / 2.0, 2))
+    step = (hi - lo) / (n_levels - 1)
+    return np.round(lo + np.round((amps - lo) / step) * step, 2)
+
+
+def snap_legatos(legatos, grid):
+    """
+    Snap the legatos of notes to the nearest multiple of grid quanta,
+    never below one grid step so that no note is silenced.
+    """
+    return np.maximum(np.round(legatos / float(grid)) * grid, grid)
+
+
+def optimize_control_patterns(
+    notes,
+    vels,
+    legatos,
+    consolidate=False,
+    amp_error=0.0,
+    legato_error=0.0,
+    byte_budget=None,
+    n_steps=8,
+):
+    """
+    Shrink the amp and legato patterns of a track.
+    Amps are bucketed into fewer levels and legatos snapped to a coarser grid, keeping the
+    max error within amp_error (in amp units) and legato_error (in quanta).
+    Without a byte_budget the coarsest setting within the error budget is used; with one,
+    the allowed error is raised in n_steps until the patterns fit in byte_budget characters.
+    A lossy setting is only kept if it makes its patterns shorter than the exact ones.
+    Returns the new velocity and legato arrays and a report of bytes and max errors.
+    """
+    on = notes != 0.0
+    bytes_before = control_pattern_bytes(notes, vels, legatos, consolidate)
+
+    # every candidate setting with its max error, from the finest to the coarsest
+    amp_candidates = [(None, 0.0)]
+    if vels is not None and on.any():
+        amps = np.round(vels[on] / 127.0, 2)
+        for n_levels in range(len(np.unique(amps)), 0, -1):
+            amp_candidates.append(
+                (n_levels, np.abs(snap_amps(amps, n_levels) - amps).max())
+            )
+    legato_candidates = [(None, 0.0)]
+    if legatos is not None and on.any():
+        note_legatos = legatos[on]
+        for grid in range(2, int(note_legatos.max()) + 1):
+            legato_candidates.append(
+                (grid, np.abs(snap_legatos(note_legatos, grid) - note_legatos).max())
+            )
+
+    def coarsest(candidates, max_error):
+        fitting = [c for c in candidates if c[1] <= max_error + 1e-9]
+        return fitting[-1]
+
+    def smallest(candidates, max_error, pattern_bytes):
+        # the coarsest setting within max_error, if it saves bytes over the exact patterns
+        setting = coarsest(candidates, max_error)
+        if setting[0] is not None and pattern_bytes(setting) >= pattern_bytes(candidates[0]):
+            return candidates[0]
+        return setting
+
+    def amp_bytes(amp_setting):
+        new_vels, _ = apply(amp_setting, legato_candidates[0])
+        return control_pattern_bytes(notes, new_vels, None, consolidate, optimize=True)
+
+    def legato_bytes(legato_setting):
+        _, new_legatos = apply(amp_candidates[0], legato_setting)
+        return control_pattern_bytes(notes, None, new_legatos, consolidate, optimize=True)
+
+    def apply(amp_setting, legato_setting):
+        new_vels = vels
+        new_legatos = legatos
+        if amp_setting[0] is not None:
+            new_vels = np.zeros(vels.shape)
+            new_vels[on] = snap_amps(np.round(vels[on] / 127.0, 2), amp_setting[0]) * 127.0
+        if legato_setting[0] is not None:
+            new_legatos = np.zeros(legatos.shape)
+            new_legatos[on] = snap_legatos(legatos[on], legato_setting[0])
+        return new_vels, new_legatos
+
+    steps = range(1, n_steps + 1) if byte_budget is not None else [n_steps]
+    for step in steps:
+        fraction = step / float(n_steps)
+        amp_setting = smallest(amp_candidates, amp_error * fraction, amp_bytes)
+        legato_setting = smallest(legato_candidates, legato_error * fraction, legato_bytes)
+        new_vels, new_legatos = apply(amp_setting, legato_setting)
+        bytes_after = control_pattern_bytes(
+            notes, new_vels, new_legatos, consolidate, optimize=True
+        )
+        if byte_budget is not None and bytes_after <= byte_budget:
+            break
+
+    report = {
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "amp_error": amp_setting[1],
+        "legato_error": legato_setting[1],
+    }
+    return new_vels, new_legatos, report
+
+
+def optimize_track(_args, track):
+    """Run optimize_control_patterns on a multitrack entry, storing the report with it."""
+    track["velocities"], track["legatos"], track["report"] = optimize_control_patterns(
+        track["notes"],
+        track["velocities"],
+        track["legatos"],
+        consolidate=_args.consolidate,
+        amp_error=_args.amp_error,
+        legato_error=_args.legato_error,
+        byte_budget=_args.byte_budget,
+    )
+
+
+def print_optimize_report(report, indent="", name=None):
+    label = f"{name}: " if name is not None else ""
+    print(
+        f"{indent}-- {label}amp/legato patterns {report['bytes_before']} -> "
+        f"{report['bytes_after']} bytes (saved {report['bytes_before'] - report['bytes_after']}), "
+        f"max amp error {round(report['amp_error'], 2)}, "
+        f"max legato error {round(report['legato_error'], 2)}"
+    )
+
+
+def weight_token(value, weight):
+    """Mini-notation value lasting weight steps, e.g. c5@12."""
+    if weight == 1:
+        return str(value)
+    return f"{value}@{weight}"
+
+
+def weighted_pattern(values, weights, rests, lead, rest_value):
+    """Alternate values with rests, all with @ weights; rests of length 0 are left out."""
+    tokens = []
+    if lead > 0:
+        tokens.append(weight_token(rest_value, lead))
+    for value, weight, rest in zip(values, weights, rests):
+        tokens.append(weight_token(value, weight))
+        if rest > 0:
+            tokens.append(weight_token(rest_value, rest))
+    return " ".join(tokens)
+
+
+def weighted_voice_events(note_table, voice, n_quanta, ticks_per_quanta):
+    """
+    The notes of one voice as they are written with @ weights: a dict with the pitch,
+    velocity and legato of every note, its weight and the rest after it (in quanta),
+    and the lead rest before the first note.
+    Every note lasts until its note off or the next note of the voice, and its legato
+    is relative to that length.
+    """
+    rows = note_table["voice"] == voice
+    quanta_index = np.minimum(
+        (note_table["onset"][rows] / ticks_per_quanta).astype(int), n_quanta - 1
+    )
+    quanta_note_off_index = (note_table["offset"][rows] / ticks_per_quanta).astype(int)
+    # as on the grid, the last note starting in a quanta wins
+    last = np.append(quanta_index[1:] != quanta_index[:-1], True)
+    quanta_index = quanta_index[last]
+    note_length = quanta_note_off_index[last] - quanta_index
+
+    gaps = np.diff(np.append(quanta_index, n_quanta))
+    weights = np.clip(note_length, 1, gaps)
+    legatos = note_length / weights.astype(float)
+    return {
+        "pitch": note_table["pitch"][rows][last],
+        "velocity": note_table["velocity"][rows][last],
+        "legato": [int(x) if x == int(x) else round(x, 2) for x in legatos],
+        "weight": weights,
+        "rest": gaps - weights,
+        "lead": quanta_index[0],
+    }
+
+
+def weighted_voice_patterns(
+    note_table,
+    voice,
+    n_quanta,
+    ticks_per_quanta,
+    velocity_on=False,
+    legato_on=False,
+    scale=None,
+    optimize=False,
+):
+    """
+    n, amp and legato patterns of one voice written as notes and rests with @ weights
+    (c5@12 ~@4 d5@3) straight from the note table, so their length grows with the number
+    of notes instead of the number of quanta (see weighted_voice_events).
+    amp and legato are None when not requested.
+    """
+    events = weighted_voice_events(note_table, voice, n_quanta, ticks_per_quanta)
+    pitches = events["pitch"]
+    weights = events["weight"]
+    rests = events["rest"]
+    lead = events["lead"]
+
+    if scale is None:
+        notes_names = [midinote_to_note_name(x) for x in pitches]
+    else:
+        notes_names = scale_degree_tokens(pitches, scale)
+    notes_str = weighted_pattern(notes_names, weights, rests, lead, "~")
+    if scale is None:
+        notes_str = f'n "{notes_str}"'
+    else:
+        notes_str = f'n ({scale_function(scale)} $ "{notes_str}")'
+        if scale["root"] != 0:
+            notes_str += f" |+ n {scale['root']}"
+
+    vels_str = None
+    legatos_str = None
+    if velocity_on:
+        amps = [vel_to_amp(x) for x in events["velocity"]]
+        if optimize and len(set(amps)) == 1:
+            vels_str = str(amps[0])
+        else:
+            vels_str = '"' + weighted_pattern(amps, weights, rests, lead, 0) + '"'
+    if legato_on:
+        legatos = events["legato"]
+        if optimize and len(set(legatos)) == 1:
+            legatos_str = str(legatos[0])
+        else:
+            legatos_str = '"' + weighted_pattern(legatos, weights, rests, lead, 0) + '"'
+    return notes_str, vels_str, legatos_str
+
+
 def print_tidal_midi_stack(
-    notes, vels=None, legatos=None, consolidate=None, scale=False
+    notes, vels=None, legatos=None, consolidate=None, scale=None, optimize=False
 ):
+    """scale is a scale from scales.build_scale, or None to print note names."""
     n_voices = len(notes[0, :])
     if scale:
-        # just 12 tone for now
-        scale_list = sorted(list(set([x % 12 for x in notes.flatten() if x != 0.0])))
-        scale_pat = " ".join([str(int(x)) for x in scale_list])
+        root_suffix = f" |+ n {scale['root']}" if scale["root"] != 0 else ""
     # determine whether a stack is needed and create a control boolean
     add_stack = (n_voices != 1) | (vels is not None) | (legatos is not None)
     if add_stack:
@@ -365,14 +675,14 @@ def print_tidal_midi_stack(
         if not scale:
             notes_names = [midinote_to_note_name(x) for x in notes[:, j]]
         elif scale:
-            notes_names = [midinote_to_scale_degree(x, scale_list) for x in notes[:, j]]
+            notes_names = scale_degree_tokens(notes[:, j], scale)
         if consolidate:
             notes_names = simplify_repeats(notes_names)
         if not scale:
             print('     n "', end="")
             print(*notes_names, sep=" ", end="")
         elif scale:
-            print('     n (tScale "' + scale_pat + '" $ "', end="")
+            print("     n (" + scale_function(scale) + ' $ "', end="")
             print(*notes_names, sep=" ", end="")
         if (
             (legatos is None) & (vels is None) & (j != n_voices - 1)
@@ -380,60 +690,102 @@ def print_tidal_midi_stack(
             if not scale:
                 print('",')
             elif scale:
-                print('" ),')
+                print('" )' + root_suffix + ",")
         else:  # else this is the last voice, so just close the quotes
             if not scale:
                 print('"')
             elif scale:
-                print('" )')  # else this is the last voice, so close the quotes
+                print('" )' + root_suffix)  # else this is the last voice, so close the quotes
         if vels is not None:
-            print('     # amp "', end="")
-            note_vels = [vel_to_amp(x) for x in vels[:, j]]
-            if consolidate:
-                note_vels = simplify_repeats(note_vels)
-            print(*note_vels, sep=" ", end="")
+            print("     # amp ", end="")
+            print(amp_pattern(notes[:, j], vels[:, j], consolidate, optimize), end="")
             # add comma if it's not the last voice and if there are no legatos
             if legatos is None:
                 if not j == len(notes[0, :]) - 1:
-                    print('",')
+                    print(",")
                 # otherwise close the stack
                 else:
-                    print('"\n     ]')
+                    print("\n     ]")
             else:  # if legatos is not None
-                print('"')
+                print("")
         if legatos is not None:
-            print('     # legato "', end="")
-            note_legatos = [x for x in legatos[:, j]]
-            if consolidate:
-                note_legatos = simplify_repeats(note_legatos)
-            print(*note_legatos, sep=" ", end="")
+            print("     # legato ", end="")
+            print(
+                legato_pattern(
+                    notes[:, j], legatos[:, j], consolidate, optimize, whole_numbers=False
+                ),
+                end="",
+            )
             # add comma if it's not the last voice
             if not j == len(notes[0, :]) - 1:
-                print('",')
+                print(",")
             # otherwise close the stack
             else:
-                print('"\n     ]')
+                print("\n     ]")
         if (legatos is None) & (vels is None) & (j == n_voices - 1) & (add_stack):
             print("     ]")
 
 
-def print_tidal(_args, notes, vels, legatos):
+def print_tidal_preamble(_args, n_quanta):
+    """Opening :{ bracket, let statement and slow command shared by the print_tidal functions."""
     if _args.brackets:
         print(":{")
     # make a let statement
     if len(_args.name) != 0:
-        print("let " + args.name + " = ", end="")
+        print("let " + _args.name + " = ", end="")
 
     # syncs tempo across all midis!
-    slow_cmd = "slow (" + str(notes.shape[0] / _args.resolution) + "/4) $ "
+    slow_cmd = "slow (" + str(n_quanta / _args.resolution) + "/4) $ "
     print(slow_cmd, end="")
+
+
+def print_tidal(_args, notes, vels, legatos):
+    print_tidal_preamble(_args, notes.shape[0])
     print_tidal_midi_stack(
-        notes, vels, legatos, consolidate=_args.consolidate, scale=_args.scale
+        notes,
+        vels,
+        legatos,
+        consolidate=_args.consolidate,
+        scale=scale_for_notes(_args, notes),
+        optimize=_args.optimize,
     )
     if _args.brackets:
         print(":}")
 
 
+def print_tidal_weighted(_args, note_table, n_quanta, ticks_per_quanta, polyphony):
+    """print_tidal for the @ weighted output, built from the note table of the track."""
+    print_tidal_preamble(_args, n_quanta)
+    scale = scale_for_notes(_args, note_table["pitch"])
+    voices = []
+    for j in range(polyphony):
+        patterns = weighted_voice_patterns(
+            note_table,
+            j,
+            n_quanta,
+            ticks_per_quanta,
+            _args.amp,
+            _args.legato,
+            scale,
+            _args.optimize,
+        )
+        voices.append(
+            "\n".join(
+                prefix + pattern
+                for prefix, pattern in zip(("     ", "     # amp ", "     # legato "), patterns)
+                if pattern is not None
+            )
+        )
+    if polyphony == 1 and not (_args.amp or _args.legato):
+        print(voices[0].strip())
+    else:
+        print("stack [")
+        print(",\n".join(voices))
+        print("     ]")
+    if _args.brackets:
+        print(":}")
+
+
 # strudel section
 
 
@@ -462,89 +814,145 @@ def print_strudel_legatos(_args, legatos, strudel_indent="\n  "):
         print(f"{strudel_indent}.legato(`{flegatos}`)", end="")
 
 
-def print_tidal_multitrack(_args, tracks_data, n_quanta):
-    """Print Tidal code for multi-track MIDI files."""
+def print_tidal_multitrack(_args, tracks_data, n_quanta, track_texts=None):
+    """
+    Print Tidal code for multi-track MIDI files.
+    track_texts can hold the already formatted block of every track (see parallel_tracks).
+    """
     print("do")
     for i, track in enumerate(tracks_data):
-        notes = track["notes"]
-        vels = track["velocities"]
-        legatos = track["legatos"]
-        track_name = track["name"]
-
-        print(f"  -- {track_name}")
-
-        # Build the pattern for this track
-        slow_cmd = f"slow ({n_quanta / _args.resolution}/4) $ "
-
-        n_voices = notes.shape[1]
-
-        if n_voices == 1:
-            # Single voice track
-            notes_names = [midinote_to_note_name(x) for x in notes[:, 0]]
-            if _args.consolidate:
-                notes_names = simplify_repeats(notes_names)
-            notes_str = " ".join(str(x) for x in notes_names)
-            print(f'  d{i + 1} $ {slow_cmd}n "{notes_str}"')
-
-            if vels is not None:
-                note_vels = [vel_to_amp(x) for x in vels[:, 0]]
-                if _args.consolidate:
-                    note_vels = simplify_repeats(note_vels)
-                vels_str = " ".join(str(x) for x in note_vels)
-                print(f'     # amp "{vels_str}"')
-
-            if legatos is not None:
-                # Convert to int if whole number (0.0 -> 0, 8.0 -> 8)
-                note_legatos = [int(x) if x == int(x) else x for x in legatos[:, 0]]
-                if _args.consolidate:
-                    note_legatos = simplify_repeats(note_legatos)
-                legatos_str = " ".join(str(x) for x in note_legatos)
-                print(f'     # legato "{legatos_str}"')
+        if track_texts is not None:
+            print(track_texts[i], end="")
         else:
-            # Multi-voice track - use stack
-            print(f"  d{i + 1} $ {slow_cmd}stack [")
-            for j in range(n_voices):
-                notes_names = [midinote_to_note_name(x) for x in notes[:, j]]
-                if _args.consolidate:
-                    notes_names = simplify_repeats(notes_names)
-                notes_str = " ".join(str(x) for x in notes_names)
-
-                comma = "," if j < n_voices - 1 else ""
-
-                if vels is not None or legatos is not None:
-                    print(f'       n "{notes_str}"')
-                    if vels is not None:
-                        note_vels = [vel_to_amp(x) for x in vels[:, j]]
-                        if _args.consolidate:
-                            note_vels = simplify_repeats(note_vels)
-                        vels_str = " ".join(str(x) for x in note_vels)
-                        print(f'       # amp "{vels_str}"')
-                    if legatos is not None:
-                        # Convert to int if whole number (0.0 -> 0, 8.0 -> 8)
-                        note_legatos = [
-                            int(x) if x == int(x) else x for x in legatos[:, j]
-                        ]
-                        if _args.consolidate:
-                            note_legatos = simplify_repeats(note_legatos)
-                        legatos_str = " ".join(str(x) for x in note_legatos)
-                        print(f'       # legato "{legatos_str}"{comma}')
-                else:
-                    print(f'       n "{notes_str}"{comma}')
-            print("     ]")
-
-        # Add sound and effects
-        print(f'     # s "superpiano"')
-        # Only add sustain if legato is not being used (legato controls duration)
-        if legatos is None:
-            print(f"     # sustain 0.5")
-        print(f"     # gain 0.8")
-        pan_val = 0.3 + (i * 0.2) if i < 4 else 0.5
-        print(f"     # pan {pan_val}")
+            print_tidal_track(_args, track, i, n_quanta)
 
     print("")
     print("hush")
 
 
+def track_voice_patterns(_args, track, j, n_quanta, scale=None):
+    """n, amp and legato patterns of voice j of a multitrack entry (amp/legato None if absent)."""
+    if track.get("table") is not None:
+        return weighted_voice_patterns(
+            track["table"],
+            j,
+            n_quanta,
+            track["ticks_per_quanta"],
+            _args.amp,
+            _args.legato,
+            scale,
+            _args.optimize,
+        )
+    notes = track["notes"]
+    vels = track["velocities"]
+    legatos = track["legatos"]
+    notes_str = note_pattern(notes[:, j], _args.consolidate, scale)
+    vels_str = None
+    legatos_str = None
+    if vels is not None:
+        vels_str = amp_pattern(notes[:, j], vels[:, j], _args.consolidate, _args.optimize)
+    if legatos is not None:
+        legatos_str = legato_pattern(
+            notes[:, j], legatos[:, j], _args.consolidate, _args.optimize
+        )
+    return notes_str, vels_str, legatos_str
+
+
+def print_tidal_track(_args, track, i, n_quanta):
+    """Print the d{i + 1} block of one track of a multi-track MIDI file."""
+    notes = track["notes"]
+    vels = track["velocities"]
+    legatos = track["legatos"]
+    track_name = track["name"]
+
+    print(f"  -- {track_name}")
+    if track.get("report") is not None and not _args.hide:
+        print_optimize_report(track["report"], indent="  ")
+    if track.get("table") is not None:
+        scale = scale_for_notes(_args, track["table"]["pitch"])
+    else:
+        scale = scale_for_notes(_args, notes)
+    if scale is not None and _args.key:
+        print(f"  -- key: {key_name(scale)}")
+
+    # Build the pattern for this track
+    slow_cmd = f"slow ({n_quanta / _args.resolution}/4) $ "
+
+    n_voices = track["polyphony"]
+
+    if n_voices == 1:
+        # Single voice track
+        notes_str, vels_str, legatos_str = track_voice_patterns(
+            _args, track, 0, n_quanta, scale
+        )
+        print(f"  d{i + 1} $ {slow_cmd}{notes_str}")
+
+        if vels_str is not None:
+            print(f"     # amp {vels_str}")
+
+        if legatos_str is not None:
+            print(f"     # legato {legatos_str}")
+    else:
+        # Multi-voice track - use stack
+        print(f"  d{i + 1} $ {slow_cmd}stack [")
+        for j in range(n_voices):
+            notes_str, vels_str, legatos_str = track_voice_patterns(
+                _args, track, j, n_quanta, scale
+            )
+
+            comma = "," if j < n_voices - 1 else ""
+
+            if vels_str is not None or legatos_str is not None:
+                print(f"       {notes_str}")
+                if vels_str is not None:
+                    print(f"       # amp {vels_str}")
+                if legatos_str is not None:
+                    print(f"       # legato {legatos_str}{comma}")
+            else:
+                print(f"       {notes_str}{comma}")
+        print("     ]")
+
+    # Add sound and effects
+    print(f'     # s "superpiano"')
+    # Only add sustain if legato is not being used (legato controls duration)
+    if not _args.legato:
+        print(f"     # sustain 0.5")
+    print(f"     # gain 0.8")
+    pan_val = 0.3 + (i * 0.2) if i < 4 else 0.5
+    print(f"     # pan {pan_val}")
+
+
+def print_strudel_weighted(
+    _args, note_table, n_quanta, ticks_per_quanta, polyphony, strudel_indent="\n  "
+):
+    """print_strudel for the @ weighted output, built from the note table of the track."""
+    voices = []
+    for j in range(polyphony):
+        events = weighted_voice_events(note_table, j, n_quanta, ticks_per_quanta)
+        spacing = (events["weight"], events["rest"], events["lead"])
+        names = [midinote_to_note_name(x, strudel_mode=True) for x in events["pitch"]]
+        voice = f"{strudel_indent}note(`{weighted_pattern(names, *spacing, '~')}`)"
+        if _args.amp:
+            amps = [vel_to_amp(x) for x in events["velocity"]]
+            if _args.optimize and len(set(amps)) == 1:
+                voice += f"{strudel_indent}.gain({amps[0]})"
+            else:
+                voice += f"{strudel_indent}.gain(`{weighted_pattern(amps, *spacing, 0)}`)"
+        if _args.legato:
+            legatos = events["legato"]
+            if _args.optimize and len(set(legatos)) == 1:
+                voice += f"{strudel_indent}.legato({legatos[0]})"
+            else:
+                voice += f"{strudel_indent}.legato(`{weighted_pattern(legatos, *spacing, 0)}`)"
+        voices.append(voice)
+    if polyphony > 1:
+        print("stack(" + ",".join(voices) + ",\n)", end="")
+        print(f".slow({n_quanta / _args.resolution}/4)")
+    else:
+        print(voices[0], end="")
+        print(f"\n.slow({n_quanta / _args.resolution}/4)")
+
+
 def print_strudel(_args, notes, vels, legatos, strudel_indent="\n  "):
     n_voices = notes.shape[1]
     # print(n_voices)
@@ -569,6 +977,125 @@ def print_strudel(_args, notes, vels, legatos, strudel_indent="\n  "):
     print(slow_cmd)
 
 
+def convert_file(_args, midi_file):
+    """Convert one MIDI file and print its code, with the options of the command line."""
+    if not _args.hide:
+        print(midi_file)
+
+    # Use multitrack mode by default, singletrack if requested
+    if (
+        not _args.singletrack
+        and _args.jobs != 1
+        and not (_args.events or _args.debug or _args.weights)
+    ):
+        from parallel_tracks import convert_tracks_parallel
+
+        tracks_data, n_quanta, track_texts = convert_tracks_parallel(
+            _args, midi_file, jobs=_args.jobs or None
+        )
+        if _args.shape:
+            print(f"quanta: {n_quanta}")
+            print(f"tracks: {len(tracks_data)}")
+            for t in tracks_data:
+                print(f"  {t['name']}: {t['polyphony']} voices")
+        print_tidal_multitrack(_args, tracks_data, n_quanta, track_texts)
+    elif not _args.singletrack:
+        tracks_data, n_quanta = midi_to_multitrack_arrays(
+            midi_file,
+            quanta_per_qn=_args.resolution,
+            velocity_on=_args.amp,
+            legato_on=_args.legato,
+            print_events=_args.events,
+            debug=_args.debug,
+            hide=_args.hide,
+            tracks=_args.tracks,
+            weighted=_args.weights,
+        )
+        if _args.optimize and not _args.weights:
+            for t in tracks_data:
+                optimize_track(_args, t)
+        if _args.shape:
+            print(f"quanta: {n_quanta}")
+            print(f"tracks: {len(tracks_data)}")
+            for t in tracks_data:
+                print(f"  {t['name']}: {t['polyphony']} voices")
+        print_tidal_multitrack(_args, tracks_data, n_quanta)
+    elif _args.weights:
+        pattern = midi.read_midifile(midi_file)
+        note_table, n_quanta, polyphony = single_track_layout(
+            pattern, _args.resolution, _args.events, _args.debug, _args.hide
+        )
+        if _args.shape:
+            print(f"quanta: {n_quanta}")
+            print(f"voices: {polyphony}")
+        if _args.scale and _args.key and not _args.hide:
+            print(f"-- key: {key_name(scale_for_notes(_args, note_table['pitch']))}")
+        printer = print_strudel_weighted if _args.strudel else print_tidal_weighted
+        printer(
+            _args,
+            note_table,
+            n_quanta,
+            pattern.resolution / _args.resolution,
+            polyphony,
+        )
+    else:
+        # Original single-track behavior
+        data = midi_to_array(
+            midi_file,
+            quanta_per_qn=_args.resolution,
+            velocity_on=_args.amp,
+            legato_on=_args.legato,
+            print_events=_args.events,
+            debug=_args.debug,
+            hide=_args.hide,
+        )
+        vels = None
+        legatos = None
+        consolidate = None
+        if _args.amp:
+            if _args.legato:
+                notes, vels, legatos = data
+            else:
+                notes, vels = data
+        elif _args.legato:
+            notes, legatos = data
+        else:
+            notes = data
+        if _args.shape:
+            print("quanta: ", end="")
+            print(notes.shape[0])
+            print("voices: ", end="")
+            print(notes.shape[1])
+        if _args.optimize:
+            vels, legatos, report = optimize_control_patterns(
+                notes,
+                vels,
+                legatos,
+                consolidate=_args.consolidate,
+                amp_error=_args.amp_error,
+                legato_error=_args.legato_error,
+                byte_budget=_args.byte_budget,
+            )
+            if not _args.hide:
+                print_optimize_report(report, name=midi_file)
+        if _args.scale and _args.key and not _args.hide:
+            print(f"-- key: {key_name(scale_for_notes(_args, notes))}")
+        if not _args.strudel:
+            print_tidal(_args, notes, vels, legatos)
+        else:
+            print_strudel(_args, notes, vels, legatos)
+
+
+def convert_file_or_report(_args, midi_file):
+    """convert_file, reporting a --tracks selection that fails on stderr. Returns success."""
+    try:
+        convert_file(_args, midi_file)
+    except TrackSelectionError as error:
+        print(f"{midi_file}: {error}", file=sys.stderr)
+        return False
+    return True
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("midi_files", nargs="*")
@@ -646,6 +1173,20 @@ if __name__ == "__main__":
         help="prints notes in a scale",
         action="store_const",
     )
+    parser.add_argument(
+        "--edo",
+        default=12,
+        type=int,
+        help="with --scale, number of equal divisions of the octave (default 12)",
+    )
+    parser.add_argument(
+        "--key",
+        "-k",
+        const=True,
+        default=False,
+        help="with --scale, root the scale on the key estimated from the pitch class histogram",
+        action="store_const",
+    )
     parser.add_argument(
         "--strudel",
         "-j",
@@ -670,57 +1211,97 @@ if __name__ == "__main__":
         help="process only last track (original behavior, for single-track MIDI)",
         action="store_const",
     )
+    parser.add_argument(
+        "--optimize",
+        "-o",
+        const=True,
+        default=False,
+        help="shrink amp and legato patterns (constant patterns become scalars) and report bytes saved",
+        action="store_const",
+    )
+    parser.add_argument(
+        "--amp-error",
+        default=0.0,
+        type=float,
+        help="with --optimize, max amp error allowed when bucketing amps into fewer levels (default 0)",
+    )
+    parser.add_argument(
+        "--legato-error",
+        default=0.0,
+        type=float,
+        help="with --optimize, max legato error in quanta allowed when snapping legatos to a grid (default 0)",
+    )
+    parser.add_argument(
+        "--byte-budget",
+        default=None,
+        type=int,
+        help="with --optimize, target size in bytes of each track's amp and legato patterns",
+    )
+    parser.add_argument(
+        "--weights",
+        "-w",
+        const=True,
+        default=False,
+        help="write each voice as notes and rests with @ weights instead of one value per quanta",
+        action="store_const",
+    )
+    parser.add_argument(
+        "--tracks",
+        "-t",
+        default=None,
+        type=str,
+        help="comma separated track indices or name globs to convert, e.g. --tracks=1,'bass*'; other tracks are not decoded",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-J",
+        default=1,
+        type=int,
+        help="quantize and format the tracks of a multitrack file on this many worker processes (0 for all cores)",
+    )
+    parser.add_argument(
+        "--share",
+        "-S",
+        const=True,
+        default=False,
+        help="bind the patterns repeated across all the files once, in a shared let block printed first",
+        action="store_const",
+    )
     args = parser.parse_args()
-    for midi_file in args.midi_files:
+    if args.byte_budget is not None and not (args.amp_error or args.legato_error):
+        parser.error(
+            "--byte-budget needs --amp-error or --legato-error, exact patterns cannot shrink further"
+        )
+    if args.tracks is not None and args.singletrack:
+        parser.error(
+            "--tracks selects tracks of a multitrack conversion, it cannot be used with --singletrack"
+        )
+    if args.weights and args.jobs != 1:
+        print("--weights output is built on one process, --jobs is ignored", file=sys.stderr)
+    if args.share and args.strudel:
+        print(
+            "--share only shares patterns of TidalCycles code, Strudel code is printed as is",
+            file=sys.stderr,
+        )
+    converted = []
+    if not args.share:
+        for midi_file in args.midi_files:
+            converted.append(convert_file_or_report(args, midi_file))
+    else:
+        outputs = []
+        for midi_file in args.midi_files:
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                converted.append(convert_file_or_report(args, midi_file))
+            if converted[-1]:
+                outputs.append(output.getvalue())
+        shared, shared_outputs = share_patterns(outputs)
         if not args.hide:
-            print(midi_file)
-
-        # Use multitrack mode by default, singletrack if requested
-        if not args.singletrack:
-            tracks_data, n_quanta = midi_to_multitrack_arrays(
-                midi_file,
-                quanta_per_qn=args.resolution,
-                velocity_on=args.amp,
-                legato_on=args.legato,
-                print_events=args.events,
-                debug=args.debug,
-                hide=args.hide,
-            )
-            if args.shape:
-                print(f"quanta: {n_quanta}")
-                print(f"tracks: {len(tracks_data)}")
-                for t in tracks_data:
-                    print(f"  {t['name']}: {t['polyphony']} voices")
-            print_tidal_multitrack(args, tracks_data, n_quanta)
-        else:
-            # Original single-track behavior
-            data = midi_to_array(
-                midi_file,
-                quanta_per_qn=args.resolution,
-                velocity_on=args.amp,
-                legato_on=args.legato,
-                print_events=args.events,
-                debug=args.debug,
-                hide=args.hide,
-            )
-            vels = None
-            legatos = None
-            consolidate = None
-            if args.amp:
-                if args.legato:
-                    notes, vels, legatos = data
-                else:
-                    notes, vels = data
-            elif args.legato:
-                notes, legatos = data
-            else:
-                notes = data
-            if args.shape:
-                print("quanta: ", end="")
-                print(notes.shape[0])
-                print("voices: ", end="")
-                print(notes.shape[1])
-            if not args.strudel:
-                print_tidal(args, notes, vels, legatos)
-            else:
-                print_strudel(args, notes, vels, legatos)
+            saved = sum(len(o) for o in outputs) - sum(len(o) for o in shared_outputs)
+            saved -= len(shared_patterns_block(shared))
+            print(f"-- shared patterns: {len(shared)}, about {saved} bytes saved")
+        print_shared_patterns(shared)
+        for output in shared_outputs:
+            print(output, end="")
+    if not all(converted):
+        sys.exit(1)
@@ -0,0 +1,162 @@
+from __future__ import print_function
+
+import midi
+import numpy as np
+
+# this module turns the note events of a MIDI pattern into a columnar note table:
+# parallel numpy arrays with one entry per note, in the order the notes were played.
+
+
+def collect_note_events(pattern, track_indices=None):
+    """
+    Flatten the note on/off events of the selected tracks into parallel arrays.
+    Ticks are absolute (cumulative within each track).
+    end_ticks holds the absolute tick of the last event of every track in the pattern.
+    """
+    if track_indices is None:
+        track_indices = range(len(pattern))
+    ticks = []
+    pitches = []
+    velocities = []
+    channels = []
+    tracks = []
+    is_on = []
+    end_ticks = np.zeros(len(pattern), dtype=np.int64)
+    for track_idx in track_indices:
+        cum_ticks = 0
+        for event in pattern[track_idx]:
+            cum_ticks += event.tick
+            event_class = type(event)
+            if event_class is midi.events.NoteOnEvent or event_class is midi.events.NoteOffEvent:
+                ticks.append(cum_ticks)
+                pitches.append(event.pitch)
+                velocities.append(event.velocity)
+                channels.append(event.channel)
+                tracks.append(track_idx)
+                # MIDI has a formatting quirk where noteOff events
+                # can also be encoded as NoteOn with velocity 0
+                is_on.append(event_class is midi.events.NoteOnEvent and event.velocity != 0)
+        end_ticks[track_idx] = cum_ticks
+    return {
+        "tick": np.array(ticks, dtype=np.int64),
+        "pitch": np.array(pitches, dtype=np.int64),
+        "velocity": np.array(velocities, dtype=np.int64),
+        "channel": np.array(channels, dtype=np.int64),
+        "track": np.array(tracks, dtype=np.int64),
+        "is_on": np.array(is_on, dtype=bool),
+        "end_ticks": end_ticks,
+    }
+
+
+def assign_voices(track, is_on):
+    """
+    Voice of every note on, using the same rule as the converters:
+    each note on takes the next voice and any note off (or a new track) resets the count.
+    """
+    n_events = len(is_on)
+    cum_ons = np.cumsum(is_on)
+    track_start = np.ones(n_events, dtype=bool)
+    track_start[1:] = track[1:] != track[:-1]
+    # the number of note ons before the most recent reset
+    reset_marker = np.where(~is_on, cum_ons, np.where(track_start, cum_ons - is_on, 0))
+    base = np.maximum.accumulate(reset_marker) if n_events else reset_marker
+    return (cum_ons - base - 1)[is_on]
+
+
+def pair_note_events(events):
+    """
+    Match every note on with a note off of the same (track, channel, pitch), first in first out.
+    Note offs without a preceding note on are dropped and note ons that are never
+    released end at the end of their track.
+    Returns the offset tick of every note on, in event order.
+    """
+    is_on = events["is_on"]
+    n_events = len(is_on)
+    if n_events == 0:
+        return np.zeros(0, dtype=np.int64)
+    key = (events["track"] * 16 + events["channel"]) * 128 + events["pitch"]
+    # stable, so events of the same key stay in time order
+    order = np.argsort(key, kind="stable")
+    sorted_key = key[order]
+    sorted_on = is_on[order]
+
+    group_start = np.ones(n_events, dtype=bool)
+    group_start[1:] = sorted_key[1:] != sorted_key[:-1]
+    group = np.cumsum(group_start) - 1
+    n_groups = group[-1] + 1
+
+    # number of currently held notes within each group
+    delta = np.where(sorted_on, 1, -1)
+    total = np.cumsum(delta)
+    group_offset = (total - delta)[group_start]
+    held = total - group_offset[group]
+
+    # running minimum within each group; shifting every group below the previous
+    # one stops the accumulation from leaking across group boundaries.
+    big = 2 * n_events + 2
+    running_min = np.minimum.accumulate(held - group * big) + group * big
+    previous_min = np.zeros(n_events, dtype=np.int64)
+    previous_min[1:] = running_min[:-1]
+    previous_min[group_start] = 0
+    # an orphan note off takes the held count to a new low below zero
+    orphan = ~sorted_on & (held < np.minimum(previous_min, 0))
+    valid_off = ~sorted_on & ~orphan
+
+    on_positions = np.flatnonzero(sorted_on)
+    off_positions = np.flatnonzero(valid_off)
+    on_group = group[on_positions]
+    on_count = np.bincount(on_group, minlength=n_groups)
+    off_count = np.bincount(group[off_positions], minlength=n_groups)
+    on_first = np.cumsum(on_count) - on_count
+    off_first = np.cumsum(off_count) - off_count
+
+    # the k-th note on of a group is released by the k-th note off of that group
+    rank = np.arange(len(on_positions)) - on_first[on_group]
+    matched = rank < off_count[on_group]
+    sorted_ticks = events["tick"][order]
+    offsets = events["end_ticks"][events["track"][order][on_positions]]
+    offsets[matched] = sorted_ticks[
+        off_positions[off_first[on_group[matched]] + rank[matched]]
+    ]
+
+    # scatter back to event order
+    offset_by_event = np.zeros(n_events, dtype=np.int64)
+    offset_by_event[order[on_positions]] = offsets
+    return offset_by_event[is_on]
+
+
+def note_table_from_pattern(pattern, track_indices=None):
+    """
+    Build a note table from a midi.Pattern: a dict of parallel arrays
+    onset, offset (absolute ticks), pitch, velocity, channel, track and voice,
+    one entry per note in the order the notes were played.
+    """
+    events = collect_note_events(pattern, track_indices)
+    is_on = events["is_on"]
+    return {
+        "onset": events["tick"][is_on],
+        "offset": pair_note_events(events),
+        "pitch": events["pitch"][is_on],
+        "velocity": events["velocity"][is_on],
+        "channel": events["channel"][is_on],
+        "track": events["track"][is_on],
+        "voice": assign_voices(events["track"], is_on),
+        "end_ticks": events["end_ticks"],
+        "resolution": pattern.resolution,
+    }
+
+
+def read_note_table(filename, track_indices=None):
+    return note_table_from_pattern(midi.read_midifile(filename), track_indices)
+
+
+def select_track(note_table, track_idx):
+    """Return the rows of the note table that belong to a single track."""
+    rows = note_table["track"] == track_idx
+    selected = {
+        key: note_table[key][rows]
+        for key in ("onset", "offset", "pitch", "velocity", "channel", "track", "voice")
+    }
+    selected["end_ticks"] = note_table["end_ticks"]
+    selected["resolution"] = note_table["resolution"]
+    return selected
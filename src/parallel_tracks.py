@@ -0,0 +1,107 @@
+from __future__ import print_function
+
+import contextlib
+import io
+import multiprocessing
+
+import midi
+import numpy as np
+
+from chunk_index import read_chunk_index, select_tracks
+from midi_to_tidalcycles import fill_arrays, optimize_track, print_tidal_track
+from note_table import note_table_from_pattern
+
+# this module quantizes and formats the tracks of a large multitrack MIDI file on a worker pool.
+# the parent only scans the raw MTrk chunks (see chunk_index) for the track names, note spans
+# and polyphony; every worker decodes its own track, builds its note table and formats it,
+# sending back only the text of its d block.
+
+
+def _convert_track(task):
+    """Worker: decode one track, fill its arrays and format its d block."""
+    _args = task["args"]
+    pattern = midi.Pattern(resolution=task["resolution"])
+    pattern.append(midi.Track())
+    with open(task["filename"], "rb") as midifile:
+        midifile.seek(task["offset"])
+        midi.FileReader().parse_track(midifile, pattern[0])
+    track_table = note_table_from_pattern(pattern)
+    note_vector, velocity_vector, legato_vector = fill_arrays(
+        track_table,
+        task["n_quanta"],
+        task["polyphony"],
+        task["ticks_per_quanta"],
+        _args.amp,
+        _args.legato,
+        clamp=True,
+    )
+    track = {
+        "name": task["name"],
+        "notes": note_vector,
+        "velocities": velocity_vector,
+        "legatos": legato_vector,
+        "polyphony": task["polyphony"],
+    }
+    if _args.optimize:
+        optimize_track(_args, track)
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        print_tidal_track(_args, track, task["i"], task["n_quanta"])
+    return output.getvalue(), track.get("report")
+
+
+def convert_tracks_parallel(_args, filename, jobs=None):
+    """
+    Multitrack conversion of filename with the tracks spread over a pool of jobs workers
+    (all cores by default). All tracks share n_quanta and the resolution.
+    Returns the tracks data (name, track_idx, polyphony and optimize report, without the
+    arrays), n_quanta and the formatted block of every track, in track order.
+    """
+    chunk_index = read_chunk_index(filename)
+    ticks_per_quanta = chunk_index["resolution"] / _args.resolution
+    # the note span of every track keeps the timing, even for unselected tracks
+    max_note_end_ticks = max([t["note_end_ticks"] for t in chunk_index["tracks"]] + [0])
+    n_quanta = int(np.ceil(max_note_end_ticks / ticks_per_quanta))
+    if _args.tracks is None:
+        track_indices = range(len(chunk_index["tracks"]))
+    else:
+        track_indices = select_tracks(chunk_index, _args.tracks)
+
+    track_infos = []
+    tasks = []
+    for track_idx in track_indices:
+        track_chunk = chunk_index["tracks"][track_idx]
+        polyphony = track_chunk["polyphony"]
+        if polyphony == 0:
+            continue
+        track_name = track_chunk["name"] or f"Track {track_idx}"
+        if not _args.hide:
+            print(f"Track {track_idx}: {track_name}, polyphony: {polyphony}")
+        track_infos.append(
+            {"name": track_name, "track_idx": track_idx, "polyphony": polyphony}
+        )
+        tasks.append(
+            {
+                "args": _args,
+                "i": len(tasks),
+                "name": track_name,
+                "filename": filename,
+                "offset": track_chunk["offset"],
+                "resolution": chunk_index["resolution"],
+                "polyphony": polyphony,
+                "n_quanta": n_quanta,
+                "ticks_per_quanta": ticks_per_quanta,
+            }
+        )
+
+    with multiprocessing.Pool(jobs) as pool:
+        # map keeps the results in track order
+        results = pool.map(_convert_track, tasks)
+
+    tracks_data = [
+        dict(track_info, report=report)
+        for track_info, (_, report) in zip(track_infos, results)
+    ]
+    track_texts = [text for text, _ in results]
+    return tracks_data, n_quanta, track_texts
@@ -0,0 +1,84 @@
+from __future__ import print_function
+
+import numpy as np
+
+# shared scale engine for the --scale output of midi_to_tidalcycles and for extract_melody.
+# note numbers are mapped to scale degrees for TidalCycles' scale functions,
+# for 12-TET or any other equal division of the octave (z-EDO).
+
+# Krumhansl-Kessler key profiles, starting on the tonic
+MAJOR_PROFILE = np.array(
+    [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88]
+)
+MINOR_PROFILE = np.array(
+    [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]
+)
+
+
+def pitch_class_histogram(notes, z=12, offset=60):
+    """Count of every pitch class among the notes (without rests), counting from offset."""
+    steps = np.asarray(notes).ravel().astype(int) - offset
+    return np.bincount(steps % z, minlength=z)
+
+
+def estimate_key(notes, z=12, offset=60):
+    """
+    Estimate the root pitch class and mode of the notes from their pitch class histogram.
+    For 12-TET the histogram is correlated with the 24 rotated major/minor profiles;
+    for other EDOs the most common pitch class is used and the mode is None.
+    """
+    histogram = pitch_class_histogram(notes, z, offset)
+    if histogram.sum() == 0:
+        return 0, None
+    if z != 12:
+        return int(np.argmax(histogram)), None
+    # row k holds the profile with its tonic on pitch class k
+    rotations = (np.arange(12)[None, :] - np.arange(12)[:, None]) % 12
+    profiles = np.concatenate([MAJOR_PROFILE[rotations], MINOR_PROFILE[rotations]])
+    profiles = profiles - profiles.mean(axis=1, keepdims=True)
+    profiles = profiles / np.linalg.norm(profiles, axis=1, keepdims=True)
+    # pearson correlation with all 24 keys at once, up to the histogram's own norm
+    correlations = profiles.dot(histogram - histogram.mean())
+    best = int(np.argmax(correlations))
+    return best % 12, "major" if best < 12 else "minor"
+
+
+def build_scale(notes, z=12, root=0, offset=60):
+    """
+    The scale made of the pitch classes that occur in the notes, counted from root.
+    Returns a dict with the sorted scale list and the pitch class -> degree inverse table
+    (-1 for pitch classes outside the scale).
+    """
+    histogram = pitch_class_histogram(notes, z, offset + root)
+    scale_list = [int(x) for x in np.flatnonzero(histogram)]
+    table = np.full(z, -1, dtype=int)
+    table[scale_list] = np.arange(len(scale_list))
+    return {
+        "scale_list": scale_list,
+        "table": table,
+        "z": z,
+        "root": root,
+        "offset": offset,
+    }
+
+
+def notes_to_scale_degrees(notes, scale):
+    """Map a whole array of notes to scale degrees at once, using the inverse table."""
+    steps = np.asarray(notes).astype(int) - scale["offset"] - scale["root"]
+    q, r = np.divmod(steps, scale["z"])
+    return q * len(scale["scale_list"]) + scale["table"][r]
+
+
+def scale_degree_tokens(notes, scale):
+    """Mini-notation tokens for a column of notes, with ~ for rests."""
+    notes = np.asarray(notes)
+    degrees = notes_to_scale_degrees(notes, scale).astype(str)
+    return np.where(notes == 0.0, "~", degrees).tolist()
+
+
+def scale_function(scale):
+    """TidalCycles scale function for this scale, e.g. tScale "0 2 3" or tScale' 19 "0 3 5"."""
+    scale_pat = " ".join(str(x) for x in scale["scale_list"])
+    if scale["z"] == 12:
+        return 'tScale "' + scale_pat + '"'
+    return "tScale' " + str(scale["z"]) + ' "' + scale_pat + '"'
@@ -0,0 +1,84 @@
+from __future__ import print_function
+
+import re
+from collections import Counter
+
+# cross-file deduplication for batch runs (see --share in midi_to_tidalcycles).
+# the voice patterns (n, # amp and # legato) of the TidalCycles code printed for every file
+# are counted, and the ones that repeat are bound once in a shared let block and referred
+# to by name. other literals such as # s "superpiano" or tScale scales are left as they are.
+# every binding has the concrete type of its uses, so GHCi parses each pattern only once.
+
+# a quoted pattern right after n, # amp, # legato or the $ of n (tScale "..." $ "...")
+VOICE_PATTERN = re.compile(r'(\bn |# amp |# legato |\$ )("[^"\n]*")')
+
+# the type of the pattern following each of the VOICE_PATTERN leads
+PATTERN_TYPES = {
+    "n ": "Pattern Note",
+    "# amp ": "Pattern Double",
+    "# legato ": "Pattern Double",
+    # scale degrees
+    "$ ": "Pattern Int",
+}
+
+
+def _code_lines(output):
+    """The lines of output that are code (comments are left as they are)."""
+    return [line for line in output.splitlines() if not line.lstrip().startswith("--")]
+
+
+def _binding(name, pattern, pattern_type):
+    return name + " = " + pattern + " :: " + pattern_type
+
+
+def share_patterns(outputs, prefix="pat"):
+    """
+    Hoist the voice patterns that occur more than once with the same type over all outputs.
+    A pattern is only named when the let binding costs fewer bytes than it saves.
+    Returns the shared patterns as (name, pattern, type) triples, in order of first
+    appearance, and the outputs with every shared pattern replaced by its name.
+    """
+    counts = Counter()
+    for output in outputs:
+        for line in _code_lines(output):
+            counts.update(
+                (pattern, PATTERN_TYPES[lead]) for lead, pattern in VOICE_PATTERN.findall(line)
+            )
+
+    names = {}
+    for (pattern, pattern_type), count in counts.items():
+        if count < 2:
+            continue
+        name = prefix + str(len(names))
+        # the indented binding line once, against count * (len(pattern) - len(name)) saved
+        if count * (len(pattern) - len(name)) > len(_binding(name, pattern, pattern_type)) + 5:
+            names[pattern, pattern_type] = name
+
+    def replace(match):
+        lead, pattern = match.groups()
+        return lead + names.get((pattern, PATTERN_TYPES[lead]), pattern)
+
+    shared_outputs = []
+    for output in outputs:
+        lines = [
+            line if line.lstrip().startswith("--") else VOICE_PATTERN.sub(replace, line)
+            for line in output.split("\n")
+        ]
+        shared_outputs.append("\n".join(lines))
+    shared = [(name, pattern, pattern_type) for (pattern, pattern_type), name in names.items()]
+    return shared, shared_outputs
+
+
+def shared_patterns_block(shared):
+    """The let block binding the shared patterns, in :{ :} brackets ("" if there are none)."""
+    if not shared:
+        return ""
+    lines = [
+        ("let " if k == 0 else "    ") + _binding(*binding) for k, binding in enumerate(shared)
+    ]
+    return ":{\n" + "\n".join(lines) + "\n:}\n"
+
+
+def print_shared_patterns(shared):
+    """Print the let block binding the shared patterns."""
+    print(shared_patterns_block(shared), end="")